@@ -6,7 +6,7 @@ import requests
 
 from elevenlabslib.User import User
 from elevenlabslib.helpers import *
-from elevenlabslib.helpers import _api_json, _api_del, _api_get, _api_multipart, _audio_is_raw, _PlayableItem
+from elevenlabslib.helpers import _deprecated, _api_json, _api_del, _api_get, _api_multipart, _audio_is_raw, _PlayableItem
 
 
 class HistoryItem(_PlayableItem):
@@ -52,7 +52,7 @@ class HistoryItem(_PlayableItem):
 
     @property
     def settings_used(self):
-        warn("This is deprecated in favor of generation_settings, which returns a GenerationOptions object instead.", DeprecationWarning)
+        _deprecated("This is deprecated in favor of generation_settings, which returns a GenerationOptions object instead.")
         return self._settingsUsed
 
     @property
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import contextlib
+import copy
 import datetime
 import io
+import itertools
 import mimetypes
 import zipfile
 
@@ -23,7 +26,7 @@ if TYPE_CHECKING:
 from elevenlabslib.Voice import Voice
 
 from elevenlabslib.helpers import *
-from elevenlabslib.helpers import _api_json, _api_get, _api_multipart, _PeekQueue, _api_tts_with_concurrency, _NumpyPlaybacker, _NumpyMp3Streamer
+from elevenlabslib.helpers import _deprecated, _open_sample_files, _api_json, _api_get, _api_multipart, _PeekQueue, _api_tts_with_concurrency, _NumpyPlaybacker, _NumpyMp3Streamer
 
 
 class User:
@@ -48,7 +51,11 @@ class User:
             self._headers[key] = value
         self._headers["xi-api-key"] = self.xi_api_key
         self.generation_queue = _PeekQueue()
+        self._generation_counter = itertools.count()   #Gives every generation a unique ID for the generation_queue.
         self._subscriptionTier = None           #Used to cache the result for mp3/pcm_highest
+        self._tts_cache: Optional[collections.OrderedDict] = None  #Only created by enable_tts_cache, it's opt-in.
+        self._tts_cache_size = 0
+        self._tts_cache_lock = threading.Lock()
         try:
             self.update_audio_quality()
         except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
@@ -105,17 +112,17 @@ class User:
         return subData["character_count"], subData["character_limit"], (subData["can_extend_character_limit"] and subData["allowed_to_extend_character_limit"])
 
     def get_current_character_count(self) -> int:
-        warn("Deprecated in favor of user.get_character_info().", DeprecationWarning)
+        _deprecated("Deprecated in favor of user.get_character_info().")
         subData = self.get_subscription_data()
         return subData["character_count"]
 
     def get_character_limit(self) -> int:
-        warn("Deprecated in favor of user.get_character_info().", DeprecationWarning)
+        _deprecated("Deprecated in favor of user.get_character_info().")
         subData = self.get_subscription_data()
         return subData["character_limit"]
 
     def get_can_extend_character_limit(self) -> bool:
-        warn("Deprecated in favor of user.get_character_info().", DeprecationWarning)
+        _deprecated("Deprecated in favor of user.get_character_info().")
         subData = self.get_subscription_data()
         return subData["can_extend_character_limit"] and subData["allowed_to_extend_character_limit"]
 
@@ -137,7 +144,7 @@ class User:
 
     #Other endpoints
     def get_available_models(self) -> list[dict]:
-        warn("This function is deprecated. Use get_models instead.", DeprecationWarning)
+        _deprecated("This function is deprecated. Use get_models instead.")
         response = _api_get("/models", self._headers)
         userData = response.json()
         return userData
@@ -246,7 +253,7 @@ class User:
         return matching_voices
 
     def get_history_items(self) -> list[HistoryItem]:
-        warn("This function is deprecated. Please use get_history_items_paginated() instead, which uses pagination.", DeprecationWarning)
+        _deprecated("This function is deprecated. Please use get_history_items_paginated() instead, which uses pagination.")
         return self.get_history_items_paginated(maxNumberOfItems=-1)
 
 
@@ -363,7 +370,7 @@ class User:
         return downloadedHistoryItems
 
     def download_history_items(self, historyItems:list[str | HistoryItem]) -> dict[str, bytes]:
-        warn("This function is deprecated, please use download_history_items_v2 instead.", DeprecationWarning)
+        _deprecated("This function is deprecated, please use download_history_items_v2 instead.")
         historyItemIDs = list()
         for item in historyItems:
             if isinstance(item, str):
@@ -453,27 +460,19 @@ class User:
         Returns:
             ClonedVoice: The new voice.
         """
-        if isinstance(samples, list):
-            if not (0 < len(samples) <= 25):
-                raise ValueError("Please include between 1 and 25 samples.")
-            sampleBytes = {}
-            for samplePath in samples:
-                if "\\" in samplePath:
-                    fileName = samplePath[samplePath.rindex("\\") + 1:]
-                else:
-                    fileName = samplePath
-                sampleBytes[fileName] = open(samplePath, "rb").read()
-        else:
-            sampleBytes = samples
+        if isinstance(samples, list) and not (0 < len(samples) <= 25):
+            raise ValueError("Please include between 1 and 25 samples.")
 
         if not labels:
             labels = dict()
 
         payload = {"name": name, "description":description, "remove_background_noise": remove_background_noise, "labels":str(labels)}
-        files = list()
-        for fileName, fileBytes in sampleBytes.items():
-            files.append(("files", (fileName, io.BytesIO(fileBytes))))
-        response = _api_multipart("/voices/add", self._headers, data=payload, filesData=files)
+        if isinstance(samples, list):
+            filesContext = _open_sample_files(samples)
+        else:
+            filesContext = contextlib.nullcontext([("files", (fileName, fileBytes)) for fileName, fileBytes in samples.items()])
+        with filesContext as files:
+            response = _api_multipart("/voices/add", self._headers, data=payload, filesData=files)
         return self.get_voice_by_ID(response.json()["voice_id"])
 
     def search_voice_library(self, search_term: str=None, use_cases: list[str]=None, descriptives: list[str]=None, sort: Optional[LibSort]=LibSort.TRENDING, advanced_filters: LibVoiceInfo=LibVoiceInfo(), starting_page=0, query_page_size=30) -> List[LibraryVoiceData]:
@@ -783,7 +782,7 @@ class User:
         if sfx_generation_options.prompt_influence:
             payload["prompt_influence"] = sfx_generation_options.prompt_influence
 
-        generationID = f"SFX - {prompt} - {time.time()}"
+        generationID = f"SFX - {next(self._generation_counter)}"
         requestFunction = lambda: _api_json("/sound-generation", self.headers, jsonData=payload)
 
         audio_future = concurrent.futures.Future()
@@ -885,6 +884,45 @@ class User:
     def update_audio_quality(self):
         self._subscriptionTier = self.get_subscription_data()["tier"]
 
+    def enable_tts_cache(self, max_items:int=128):
+        """
+        Keeps the results of recent text to speech generations (Voice.generate_audio_v3 with a text prompt) in memory.
+        Generating the same text with the same voice and options again then returns the stored audio instead of making (and paying for) another request.
+
+        Note:
+            The GenerationInfo of a cached result is the one from the original request.
+            Without a seed the API would return a slightly different take each time, with the cache you'll always get the first one.
+
+        Args:
+            max_items (int, optional): How many generations to keep. The least recently used ones are dropped first. 0 disables the cache (and clears it).
+        """
+        with self._tts_cache_lock:
+            self._tts_cache_size = max_items
+            if max_items <= 0:
+                self._tts_cache = None
+                return
+            if self._tts_cache is None:
+                self._tts_cache = collections.OrderedDict()
+            while len(self._tts_cache) > max_items:
+                self._tts_cache.popitem(last=False)
+
+    def _get_cached_tts(self, key:str) -> Optional[Tuple[bytes, GenerationInfo]]:
+        with self._tts_cache_lock:
+            if self._tts_cache is None or key not in self._tts_cache:
+                return None
+            self._tts_cache.move_to_end(key)
+            audioData, generationInfo = self._tts_cache[key]
+        return audioData, copy.deepcopy(generationInfo)    #Every caller gets their own GenerationInfo (transcript included), so nobody can change the cached one.
+
+    def _cache_tts(self, key:str, audioData:bytes, generationInfo:GenerationInfo):
+        with self._tts_cache_lock:
+            if self._tts_cache is None:
+                return
+            self._tts_cache[key] = (audioData, copy.deepcopy(generationInfo))  #The original is handed to the first caller.
+            self._tts_cache.move_to_end(key)
+            if len(self._tts_cache) > self._tts_cache_size:
+                self._tts_cache.popitem(last=False)
+
     def get_real_audio_format(self, generationOptions:GenerationOptions) -> GenerationOptions:
         """
         Parameters:
@@ -893,10 +931,11 @@ class User:
         Returns:
             A GenerationOptions object with a real audio format (if the original was mp3_highest or pcm_highest, it's modified accordingly, otherwise returned directly)
         """
-        if self._subscriptionTier is None:
-            self.update_audio_quality()
         generationOptions = dataclasses.replace(generationOptions)
         if "highest" in generationOptions.output_format:
+            #Only the "highest" formats depend on the tier, so only fetch it (an API call) when we actually need it.
+            if self._subscriptionTier is None:
+                self.update_audio_quality()
             if "mp3" in generationOptions.output_format:
                 if subscription_tiers.index(self._subscriptionTier) >= subscription_tiers.index("creator"):
                     generationOptions.output_format = "mp3_44100_192"
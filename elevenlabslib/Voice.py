@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import concurrent.futures
+import hashlib
 from typing import Iterator, Dict
 from typing import TYPE_CHECKING
 
@@ -12,7 +13,7 @@ if TYPE_CHECKING:
     from elevenlabslib.User import User
 
 from elevenlabslib.helpers import *
-from elevenlabslib.helpers import _api_json, _api_del, _api_get, _api_multipart, _api_tts_with_concurrency, _reformat_transcript, _NumpyMp3Streamer, _NumpyRAWStreamer, _NumpyPlaybacker, _pcm_to_wav, \
+from elevenlabslib.helpers import _deprecated, _open_sample_files, _unset_voice_settings, _api_json, _api_del, _api_get, _api_multipart, _api_session, _api_tts_with_concurrency, _reformat_transcript, _NumpyMp3Streamer, _NumpyRAWStreamer, _NumpyPlaybacker, _pcm_to_wav, \
     _ulaw_to_wav
 
 
@@ -63,9 +64,19 @@ class Voice:
         self._category = voiceData["category"]
         self._sharingData = voiceData["sharing"]
         self._settings = voiceData["settings"]
+        self._previewURL = voiceData.get("preview_url")
+
+        # The voiceID never changes, so build the endpoints once instead of on every call.
+        self._tts_path = f"/text-to-speech/{self.voiceID}/with-timestamps"
+        self._tts_stream_path = f"/text-to-speech/{self.voiceID}/stream/with-timestamps"
+        self._sts_stream_path = f"/speech-to-speech/{self.voiceID}/stream"
+        self._stream_input_url = f"wss://api.elevenlabs.io/v1/text-to-speech/{self.voiceID}/stream-input"
+        self._info_path = f"/voices/{self.voiceID}"
+        self._settings_edit_path = f"/voices/{self.voiceID}/settings/edit"
+        self._edit_path = f"/voices/{self.voiceID}/edit"
 
     def get_settings(self) -> dict:
-        warn("The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.", DeprecationWarning)
+        _deprecated("The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.")
         return self.update_data()["settings"]
 
     def update_data(self) -> dict:
@@ -80,27 +91,28 @@ class Voice:
         Returns:
             dict: A dict containing all the metadata for the voice, such as the name, the description, etc.
         """
-        response = _api_get("/voices/" + self.voiceID, self._linkedUser.headers, params={"with_settings": True})
+        response = _api_get(self._info_path, self._linkedUser.headers, params={"with_settings": True})
 
         voiceData = response.json()
         self.name = voiceData["name"]
         self.description = voiceData["description"]
         self._sharingData = voiceData["sharing"]
         self._settings = voiceData["settings"]
+        self._previewURL = voiceData.get("preview_url")
 
-        return response.json()
+        return voiceData
 
     def get_info(self) -> dict:
-        warn("Deprecated. voice.update_data() fulfills the same role.", DeprecationWarning)
+        _deprecated("Deprecated. voice.update_data() fulfills the same role.")
         return self.update_data()
 
 
     def get_name(self) -> str:
-        warn("Deprecated. The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.", DeprecationWarning)
+        _deprecated("Deprecated. The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.")
         return self.update_data()["name"]
 
     def get_description(self) -> str|None:
-        warn("Deprecated. The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.", DeprecationWarning)
+        _deprecated("Deprecated. The new method is to use the properties combined with update_data(). See the guide at https://elevenlabslib.readthedocs.io.")
         return self.update_data()["description"]
 
     @property
@@ -165,18 +177,14 @@ class Voice:
             ValueError: If the provided values don't fit the correct ranges.
         """
 
-        if None in (stability, similarity_boost, style, use_speaker_boost):
-            oldSettings = self.settings
-            if stability is None: stability = oldSettings["stability"]
-            if similarity_boost is None: stability = oldSettings["similarity_boost"]
-            if style is None: style = oldSettings["style"]
-            if use_speaker_boost is None: style = oldSettings["use_speaker_boost"]
+        payload = {"stability": stability, "similarity_boost": similarity_boost, "style":style, "use_speaker_boost":use_speaker_boost}
+        for key in _unset_voice_settings(payload):  #Only reads the stored settings if something was left out.
+            payload[key] = self.settings[key]
 
-        for arg in (stability, similarity_boost, style):
+        for arg in (payload["stability"], payload["similarity_boost"], payload["style"]):
             if not (0 <= arg <= 1):
                 raise ValueError("Please provide a value between 0 and 1.")
-        payload = {"stability": stability, "similarity_boost": similarity_boost, "style":style, "use_speaker_boost":use_speaker_boost}
-        _api_json("/voices/" + self.voiceID + "/settings/edit", self._linkedUser.headers, jsonData=payload)
+        _api_json(self._settings_edit_path, self._linkedUser.headers, jsonData=payload)
         self._settings = payload
 
     def _generate_payload_and_options(self, prompt:Union[str, bytes, BinaryIO], generation_options:GenerationOptions=None, stitching_options:StitchingOptions=None) -> (dict, GenerationOptions):
@@ -190,13 +198,10 @@ class Voice:
         Returns:
             A tuple of:
             dict: A dictionary representing the payload for the API call.
-            GenerationOptions: The generationOptions with the real values (including those taken from the stored settings)
+            GenerationOptions: The generationOptions with the real values (including those taken from the stored settings, if any had to be filled in)
         """
 
-        generation_options = dataclasses.replace(generation_options)  #Ensure we have a copy, not the original.
-        generation_options = self._complete_generation_options(generation_options)
-
-        voice_settings = generation_options.get_voice_settings_dict()
+        voice_settings, generation_options = self._get_voice_settings_override(generation_options)
 
         model_id = generation_options.model_id
 
@@ -236,10 +241,11 @@ class Voice:
 
 
 
-        if isinstance(prompt, str):
-            payload["voice_settings"] = voice_settings
-        else:
-            payload["voice_settings"] = json.dumps(voice_settings)
+        if voice_settings is not None:
+            if isinstance(prompt, str):
+                payload["voice_settings"] = voice_settings
+            else:
+                payload["voice_settings"] = json.dumps(voice_settings)
 
         #Clean up empty values
         keys_to_pop = []
@@ -254,15 +260,28 @@ class Voice:
     def _complete_generation_options(self, generationOptions:GenerationOptions) -> GenerationOptions:
         generationOptions = self._linkedUser.get_real_audio_format(generationOptions)
         generationOptions = dataclasses.replace(generationOptions)
-        for key, currentValue in self.settings.items():
-            overriddenValue = getattr(generationOptions, key, None)
-            if overriddenValue is None:
-                setattr(generationOptions, key, currentValue)
+        #Only go through the stored settings (which may need an API call to fetch) if there's actually a value missing.
+        for key in _unset_voice_settings(generationOptions.get_voice_settings_dict()):
+            setattr(generationOptions, key, self.settings.get(key))
         return generationOptions
 
+    def _get_voice_settings_override(self, generationOptions:GenerationOptions) -> (Optional[dict], GenerationOptions):
+        """
+        Returns:
+            A tuple of:
+            dict|None: The voice_settings to send along with a request, or None if the generationOptions don't set any (the API then uses the stored settings by itself, so there's no need to fetch them).
+            GenerationOptions: A copy of the generationOptions with the real audio format, and with the stored settings filled in if any were overridden.
+        """
+        voiceSettings = generationOptions.get_voice_settings_dict()
+        if len(_unset_voice_settings(voiceSettings)) == len(voiceSettings):
+            return None, self._linkedUser.get_real_audio_format(generationOptions)
+        generationOptions = self._complete_generation_options(generationOptions)
+        return generationOptions.get_voice_settings_dict(), generationOptions
+
     def _generate_parameters(self, generationOptions:GenerationOptions = None):
         params = dict()
-        generationOptions = self.linkedUser.get_real_audio_format(generationOptions)
+        if "highest" in generationOptions.output_format:    #Usually already resolved by the caller, don't redo it.
+            generationOptions = self.linkedUser.get_real_audio_format(generationOptions)
         params["optimize_streaming_latency"] = generationOptions.latencyOptimizationLevel
         params["output_format"] = generationOptions.output_format
         return params
@@ -273,13 +292,13 @@ class Voice:
 
         Args:
             websocketOptions (WebsocketOptions): The settings for the websocket.
-            generationOptions (GenerationOptions): The options for this generation (with all values, so make a copy and run self._complete_generation_options() on it first!)
+            generationOptions (GenerationOptions): The options for this generation.
         Returns:
             A tuple of:
             dict: A dictionary representing the payload for the API call.
             GenerationOptions: The generationOptions with the real values (including those taken from the stored settings)
         """
-        voice_settings = self._complete_generation_options(generationOptions).get_voice_settings_dict()
+        voice_settings, _ = self._get_voice_settings_override(generationOptions)
 
         if websocketOptions is None:
             websocketOptions = WebsocketOptions()
@@ -293,10 +312,12 @@ class Voice:
 
         if voice_settings is not None:
             BOS["voice_settings"] = voice_settings
-        websocketURL = f"wss://api.elevenlabs.io/v1/text-to-speech/{self.voiceID}/stream-input?model_id={generationOptions.model_id}"
+        websocketURL = f"{self._stream_input_url}?model_id={generationOptions.model_id}"
         for key, value in self._generate_parameters(generationOptions).items():
             websocketURL += f"&{key}={value}"
         websocketURL += f"&enable_ssml_parsing={str(websocketOptions.enable_ssml_parsing).lower()}"
+        if websocketOptions.auto_mode:
+            websocketURL += "&auto_mode=true"
 
         if generationOptions.language_code:
             websocketURL += f"&language_code={generationOptions.language_code}"
@@ -333,23 +354,37 @@ class Voice:
         generation_options = self.linkedUser.get_real_audio_format(generation_options)
 
         if prompting_options:
-            warn("The prompting_options parameter is outdated and will be removed. Use stitching_options instead.", DeprecationWarning)
+            _deprecated("The prompting_options parameter is outdated and will be removed. Use stitching_options instead.")
             stitching_options = prompting_options
 
 
         payload, generation_options = self._generate_payload_and_options(prompt, generation_options, stitching_options)
         params = self._generate_parameters(generation_options)
+        cacheKey = None
         if isinstance(prompt, str):
-            generationID = f"{self.voiceID} - {prompt} - {time.time()}"
-            requestFunction = lambda: _api_json("/text-to-speech/" + self.voiceID + "/with-timestamps", self._linkedUser.headers, jsonData=payload, params=params)
+            if self._linkedUser._tts_cache is not None:
+                #The payload and params hold everything that affects the output, so together with the voice they identify the result.
+                #Without an override the API uses the stored settings, so those have to be part of the key (edit_settings and update_data keep them current).
+                keySettings = None if "voice_settings" in payload else self.settings
+                cacheKey = hashlib.sha256(json.dumps([self.voiceID, payload, params, keySettings], sort_keys=True).encode("utf-8")).hexdigest()
+                cachedResult = self._linkedUser._get_cached_tts(cacheKey)
+                if cachedResult is not None:
+                    audio_future = concurrent.futures.Future()
+                    info_future = concurrent.futures.Future()
+                    audio_future.set_result(cachedResult[0])
+                    info_future.set_result(cachedResult[1])
+                    return audio_future, info_future
+
+            generationID = f"{self.voiceID} - {next(self._linkedUser._generation_counter)}"
+            requestFunction = lambda: _api_json(self._tts_path, self._linkedUser.headers, jsonData=payload, params=params)
         else:
             if "output_format" in params:
                 params.pop("output_format")
 
-            source_audio, io_hash = io_hash_from_audio(prompt)
+            source_audio, _ = io_hash_from_audio(prompt)
             files = {"audio": source_audio}
-            generationID = f"{self.voiceID} - {io_hash} - {time.time()}"
-            requestFunction = lambda: _api_multipart("/speech-to-speech/" + self.voiceID + "/stream",
+            generationID = f"{self.voiceID} - {next(self._linkedUser._generation_counter)}"
+            requestFunction = lambda: _api_multipart(self._sts_stream_path,
                                                      self._linkedUser.headers, data=payload, params=params, filesData=files, stream=True)
 
         audio_future = concurrent.futures.Future()
@@ -362,18 +397,21 @@ class Voice:
             response_dict  = json.loads(responseData.decode("utf-8"))
             audioData = base64.b64decode(response_dict["audio_base64"])
 
-            info_future.set_result(GenerationInfo(history_item_id=response_headers.get("history-item-id"),
+            generationInfo = GenerationInfo(history_item_id=response_headers.get("history-item-id"),
                                             request_id=response_headers.get("request-id"),
                                             tts_latency_ms=response_headers.get("tts-latency-ms"),
                                             transcript=_reformat_transcript(response_dict['alignment']),
-                                            character_cost=int(response_headers.get("character-cost", "-1"))))
+                                            character_cost=int(response_headers.get("character-cost", "-1")))
+            info_future.set_result(generationInfo)
 
             if "output_format" in params:
                 if "pcm" in params["output_format"]:
-                    audioData = _pcm_to_wav(audioData, int(params["output_format"].lower().replace("pcm_", "")))
+                    audioData = _pcm_to_wav(audioData, generation_options.sample_rate)
                 if "ulaw" in params["output_format"]:
-                    audioData = _ulaw_to_wav(audioData, int(params["output_format"].lower().replace("ulaw_", "")))
+                    audioData = _ulaw_to_wav(audioData, generation_options.sample_rate)
 
+            if cacheKey is not None:
+                self._linkedUser._cache_tts(cacheKey, audioData, generationInfo)
             audio_future.set_result(audioData)
 
         threading.Thread(target=wrapped).start()
@@ -387,35 +425,35 @@ class Voice:
         Internal use only - sets up and returns a _NumpyStreamer of the correct type, which will stream the audio data.
         """
         # We need the real sample rate.
-        generation_options = self._complete_generation_options(generation_options)
+        generation_options = self._linkedUser.get_real_audio_format(generation_options)
 
         response_connection_future = concurrent.futures.Future()
         if isinstance(prompt, str):
             payload, generation_options = self._generate_payload_and_options(prompt, generation_options, stitching_options)
-            path = "/text-to-speech/" + self.voiceID + "/stream/with-timestamps"
+            path = self._tts_stream_path
             # Not using input streaming
             params = self._generate_parameters(generation_options)
             requestFunction = lambda: _api_json(path, headers=self._linkedUser.headers, jsonData=payload, stream=True, params=params)
 
-            generationID = f"{self.voiceID} - {prompt} - {time.time()}"
+            generationID = f"{self.voiceID} - {next(self._linkedUser._generation_counter)}"
             def wrapper():
                 response_connection_future.set_result(_api_tts_with_concurrency(requestFunction, generationID, self._linkedUser.generation_queue))
             threading.Thread(target=wrapper).start()
 
         elif isinstance(prompt, io.IOBase) or isinstance(prompt, bytes):
             payload, generation_options = self._generate_payload_and_options(prompt, generation_options, stitching_options)
-            path = "/speech-to-speech/" + self.voiceID + "/stream"
+            path = self._sts_stream_path
             # Using speech to speech
             params = self._generate_parameters(generation_options)
             if "output_format" in params:
                 params.pop("output_format")
 
-            source_audio, audio_hash = io_hash_from_audio(prompt)
+            source_audio, _ = io_hash_from_audio(prompt)
 
             files = {"audio": source_audio}
 
             requestFunction = lambda: _api_multipart(path, headers=self._linkedUser.headers, data=payload, stream=True, filesData=files, params=params)
-            generationID = f"{self.voiceID} - {audio_hash} - {time.time()}"
+            generationID = f"{self.voiceID} - {next(self._linkedUser._generation_counter)}"
             def wrapper():
                 response_connection_future.set_result(_api_tts_with_concurrency(requestFunction, generationID, self._linkedUser.generation_queue))
             threading.Thread(target=wrapper).start()
@@ -466,10 +504,10 @@ class Voice:
                 - An optional future containing a GenerationInfo with metadata about the audio generation.
         """
 
-        generation_options = self._complete_generation_options(generation_options)
+        generation_options = self._linkedUser.get_real_audio_format(generation_options)
 
         if prompting_options:
-            warn("The prompting_options parameter is outdated and will be removed. Use stitching_options instead.", DeprecationWarning)
+            _deprecated("The prompting_options parameter is outdated and will be removed. Use stitching_options instead.")
             stitching_options = prompting_options
 
         streamer: Union[_NumpyMp3Streamer, _NumpyRAWStreamer] = self._setup_streamer(prompt, generation_options, websocket_options, stitching_options)
@@ -511,7 +549,9 @@ class Voice:
         Returns:
             str|None: The preview URL of the voice, or None if it hasn't been generated.
         """
-        return self.update_data()["preview_url"]
+        if self._previewURL is None:
+            self.update_data()  #It may have been generated since we last checked. Once it exists it doesn't change, so there's no need to fetch it again.
+        return self._previewURL
 
     def get_preview_bytes(self) -> bytes:
         """
@@ -525,7 +565,7 @@ class Voice:
         previewURL = self.get_preview_url()
         if previewURL is None:
             raise RuntimeError("No preview URL available!")
-        response = requests.get(previewURL, allow_redirects=True, timeout=requests_timeout)
+        response = _api_session.get(previewURL, allow_redirects=True, timeout=requests_timeout)
         return response.content
 
     def play_preview_v2(self, playbackOptions:PlaybackOptions=PlaybackOptions()) -> sd.OutputStream:
@@ -549,12 +589,15 @@ class EditableVoice(Voice):
             newLabels (str): The new labels
             description (str): The new description
         """
-        currentInfo = self.update_data()
-        payload = {
-            "name": currentInfo["name"],
-            "labels": currentInfo["labels"],
-            "description": currentInfo["description"]
-        }
+        if None in (newName, newLabels, description):
+            currentInfo = self.update_data()    #Only needed to fill in whatever isn't being changed.
+            payload = {
+                "name": currentInfo["name"],
+                "labels": currentInfo["labels"],
+                "description": currentInfo["description"]
+            }
+        else:
+            payload = dict()
         if newName is not None:
             payload["name"] = newName
         if newLabels is not None:
@@ -563,14 +606,16 @@ class EditableVoice(Voice):
             payload["labels"] = newLabels
         if description is not None:
             payload["description"] = description
-        _api_multipart("/voices/" + self.voiceID + "/edit", self._linkedUser.headers, data=payload)
+        _api_multipart(self._edit_path, self._linkedUser.headers, data=payload)
+        self.name = payload["name"]
+        self.description = payload["description"]
     def delete_voice(self):
         """
         This function deletes the voice, and also sets the voiceID to be empty.
         """
         if self._category == "premade":
             raise RuntimeError("Cannot delete premade voices!")
-        response = _api_del("/voices/" + self.voiceID, self._linkedUser.headers)
+        response = _api_del(self._info_path, self._linkedUser.headers)
         self.voiceID = ""
 
 class DesignedVoice(EditableVoice):
@@ -622,7 +667,8 @@ class ProfessionalVoice(EditableVoice):
         return outputList
 
     def get_high_quality_models(self) -> list[Model]:
-        return [model for model in self.linkedUser.get_models() if model.modelID in self.update_data()["high_quality_base_model_ids"]]
+        high_quality_ids = set(self.update_data()["high_quality_base_model_ids"])    #Only fetch it once, not once per model.
+        return [model for model in self.linkedUser.get_models() if model.modelID in high_quality_ids]
 
 class ClonedVoice(EditableVoice):
     """
@@ -656,38 +702,38 @@ class ClonedVoice(EditableVoice):
 
         """
         if isinstance(samples, str):
-            samples = list(samples)
+            samples = [samples]
 
-        sampleBytes = {}
-        for samplePath in samples:
-            if "\\" in samplePath:
-                fileName = samplePath[samplePath.rindex("\\")+1:]
-            else:
-                fileName = samplePath
-            sampleBytes[fileName] = open(samplePath, "rb").read()
-        self.add_samples_bytes(sampleBytes)
+        if len(samples) == 0:
+            raise ValueError("Please add at least one sample!")
+
+        with _open_sample_files(samples) as files:
+            self._upload_samples(files)
 
     #Requires a dict of filenames and bytes
-    def add_samples_bytes(self, samples:dict[str, bytes]):
+    def add_samples_bytes(self, samples:dict[str, bytes]|list[tuple[str, bytes]]):
         """
         This function adds samples to the current voice by their file names and bytes.
 
         Args:
-            samples (dict[str, bytes]): A dictionary of audio file names and their respective bytes.
+            samples (dict[str, bytes]|list[tuple[str, bytes]]): A dictionary of audio file names and their respective bytes, or a list of (file name, bytes) tuples if some names repeat.
 
         Raises:
             ValueError: If no samples are provided.
 
         """
-        if len(samples.keys()) == 0:
+        if isinstance(samples, dict):
+            samples = samples.items()
+
+        files = [("files", (fileName, fileBytes)) for fileName, fileBytes in samples]   #requests takes the bytes as they are, no need to wrap them.
+        if len(files) == 0:
             raise ValueError("Please add at least one sample!")
 
-        payload = {"name":self.update_data()["name"]}   #Has to be up to date.
-        files = list()
-        for fileName, fileBytes in samples.items():
-            files.append(("files", (fileName, io.BytesIO(fileBytes))))
+        self._upload_samples(files)
 
-        _api_multipart("/voices/" + self.voiceID + "/edit", self._linkedUser.headers, data=payload, filesData=files)
+    def _upload_samples(self, files:list):
+        payload = {"name":self.update_data()["name"]}   #Has to be up to date.
+        _api_multipart(self._edit_path, self._linkedUser.headers, data=payload, filesData=files)
 
 class LibraryVoiceData:
     def __init__(self, lib_voice_data):
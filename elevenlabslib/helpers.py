@@ -1,17 +1,20 @@
 from __future__ import annotations
 
 import asyncio
-import audioop
 import base64
+import binascii
+import collections
 import concurrent.futures
-import warnings
+import contextlib
 from concurrent.futures import Future
 import dataclasses
+import functools
 import inspect
 import io
 from enum import Enum
 import logging
 import queue
+import struct
 import threading
 import time
 import zlib
@@ -25,6 +28,7 @@ import sounddevice as sd
 import soundfile
 import soundfile as sf
 import requests
+import requests.adapters
 import os
 
 from typing import TYPE_CHECKING
@@ -35,7 +39,25 @@ from tokenizers import Tokenizer
 
 # These are hardcoded because they just plain work. If you really want to change them, please be careful.
 _playbackBlockSize = 2048
-_downloadChunkSize = 4096
+_downloadChunkSize = None   #None means every chunk is handed over as soon as it arrives, rather than being split/collected to a fixed size.
+_mp3HeaderMinBytes = 4096    #How much mp3 data to collect before trying to open it, fewer bytes usually just fail to parse.
+_inputQueueSize = 16    #How many input streaming messages can be waiting to be sent before we stop pulling from the user's iterator.
+
+#Websocket end of stream message. It never changes, so there's no point in re-serializing it for every generation.
+_END_OF_STREAM = json.dumps(dict(text=""))
+
+#Reciprocal of the int16 max, used to normalize int16 PCM to float32 in a single multiply.
+_INT16_INV = np.float32(1.0 / np.iinfo(np.int16).max)
+
+def _build_ulaw_table() -> np.ndarray:
+    # Standard G.711 u-law expansion (same output as audioop.ulaw2lin), evaluated once for all 256 possible bytes.
+    u = np.invert(np.arange(256, dtype=np.uint8)).astype(np.int32)
+    t = (((u & 0x0F) << 3) + 0x84) << ((u & 0x70) >> 4)
+    return np.where(u & 0x80, 0x84 - t, t - 0x84).astype(np.int16)
+
+_ULAW_TABLE = _build_ulaw_table()
+#Same table, already normalized to float32. Lets the u-law stream go from bytes to playback-ready samples in one gather.
+_ULAW_FLOAT_TABLE = np.multiply(_ULAW_TABLE, _INT16_INV, dtype=np.float32)
 
 if TYPE_CHECKING:
     from elevenlabslib.HistoryItem import HistoryItem
@@ -46,6 +68,14 @@ api_endpoint = "https://api.elevenlabs.io/v1"
 default_headers = {'accept': '*/*'}
 requests_timeout = 900
 
+#Shared session so that consecutive API calls reuse the same keep-alive connection (and TLS session) instead of opening a new one each time.
+_api_session = requests.Session()
+#Bigger pool than the default 10 since generations, uploads and metadata calls can all be in flight at once from different threads.
+#Only errors while establishing a new connection are retried, since then the request was never sent (so it's safe even for generations).
+#Everything else (read errors, including a pooled connection the server already dropped, and any other error) is raised as before, so a POST is never sent twice.
+_api_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                                             max_retries=requests.adapters.Retry(total=2, connect=2, read=False, other=0, status=0, redirect=0, backoff_factor=0.1)))
+
 #FYI, "pro" = "independent_publisher"
 subscription_tiers = ["free", "starter", "creator", "pro", "growing_business", "enterprise"]
 
@@ -174,13 +204,13 @@ def _api_get(path, headers, stream=False, params=None) -> requests.Response:
     }
     if params is not None:
         args["params"] = params
-    return _api_call_v2(requests.get, args)
+    return _api_call_v2(_api_session.get, args)
 def _api_del(path, headers) -> requests.Response:
     args = {
         "path": path,
         "headers": headers
     }
-    return _api_call_v2(requests.delete, args)
+    return _api_call_v2(_api_session.delete, args)
 def _api_json(path, headers, jsonData, stream=False, params=None) -> requests.Response:
     args = {
         "path":path,
@@ -190,7 +220,7 @@ def _api_json(path, headers, jsonData, stream=False, params=None) -> requests.Re
     }
     if params is not None:
         args["params"] = params
-    return _api_call_v2(requests.post, args)
+    return _api_call_v2(_api_session.post, args)
 
 def _api_multipart(path, headers, data, filesData=None, stream=False, params=None) -> requests.Response:
     args = {
@@ -209,7 +239,13 @@ def _api_multipart(path, headers, data, filesData=None, stream=False, params=Non
     if params is not None:
         args["params"] = params
 
-    return _api_call_v2(requests.post, args)
+    return _api_call_v2(_api_session.post, args)
+
+@contextlib.contextmanager
+def _open_sample_files(samplePaths:List[str]) -> Iterator[list]:
+    """Opens the given sample files as multipart "files" entries. All the handles are closed on exit, including when opening one of the files fails."""
+    with contextlib.ExitStack() as stack:
+        yield [("files", (os.path.basename(samplePath), stack.enter_context(open(samplePath, "rb")))) for samplePath in samplePaths]
 
 def _pretty_print_POST(res:requests.Response):
     req = res.request
@@ -241,6 +277,12 @@ class PlaybackOptions:
     onPlaybackEnd: Callable[[], Any] = lambda: None
     audioPostProcessor: Callable[[np.ndarray, int], np.ndarray] = lambda x, y : x
 
+def _sample_rate_from_format(audioFormat:str) -> int:
+    #Every real output_format has the sample rate as its second part (mp3_44100_128, pcm_24000, ulaw_8000).
+    if "highest" in audioFormat:
+        raise ValueError(f"{audioFormat} doesn't have a fixed sample rate. Resolve it with User.get_real_audio_format first.")
+    return int(audioFormat.split("_")[1])
+
 @dataclasses.dataclass
 class GenerationOptions:
     """
@@ -303,6 +345,16 @@ class GenerationOptions:
         if self.output_format not in validOutputFormats:
             raise ValueError("Selected output format is not valid.")
 
+    @property
+    def sample_rate(self) -> int:
+        """
+        The sample rate of the output_format. Only valid once mp3_highest/pcm_highest have been resolved (see User.get_real_audio_format).
+
+        Raises:
+            ValueError: If the output_format is still mp3_highest/pcm_highest.
+        """
+        return _sample_rate_from_format(self.output_format)
+
     def get_voice_settings_dict(self) -> dict:
         return {
             "similarity_boost":self.similarity_boost,
@@ -311,6 +363,10 @@ class GenerationOptions:
             "use_speaker_boost":self.use_speaker_boost
         }
 
+def _unset_voice_settings(voice_settings:dict) -> List[str]:
+    """Returns the keys of the voice settings that weren't given (are None), so they can be filled in from the stored ones."""
+    return [key for key, value in voice_settings.items() if value is None]
+
 @dataclasses.dataclass
 class WebsocketOptions:
     """
@@ -320,10 +376,12 @@ class WebsocketOptions:
         chunk_length_schedule (list[int], optional): Chunking schedule for generation. If you pass [50, 120, 500], the first audio chunk will be generated after recieving 50 characters, the second after 120 more (so 170 total), and the third onwards after 500. Defaults to [50], so always generating ASAP.
         try_trigger_generation (bool, optional): Whether to try and generate a chunk of audio at >50 characters, regardless of the chunk_length_schedule. Defaults to False, sent with every message (but can be overridden).
         enable_ssml_parsing (bool, optional): Whether to enable parsing of SSML tags, such as breaks or pronunciations. Increases latency. Defaults to False.
+        auto_mode (bool, optional): Whether to let the server generate as soon as it gets full sentences, skipping the chunk_length_schedule buffering. Reduces latency, but only use it if the text you send is made of complete sentences/phrases. Defaults to False.
     """
     try_trigger_generation: bool = False
     chunk_length_schedule: List[int] = dataclasses.field(default_factory=lambda: [125])
     enable_ssml_parsing: bool = False
+    auto_mode: bool = False
     def __post_init__(self):
         for value in self.chunk_length_schedule:
             if not(50 <= value <= 500):
@@ -400,14 +458,15 @@ class StitchingOptions:
         if self.next_text is not None:
             self.auto_next_text = False
 
+@functools.lru_cache(maxsize=None)
+def _deprecated(message:str) -> None:
+    #Emits each deprecation warning only once, so legacy methods called in a loop don't pay for warn()'s frame inspection every time.
+    warn(message, DeprecationWarning, stacklevel=3)
+
 def PromptingOptions(pre_prompt: str = "", post_prompt: str = "",
                      open_quote_duration_multiplier: Optional[float] = None,
                      close_quote_duration_multiplier: Optional[float] = None):
-    warnings.warn(
-        "PromptingOptions is deprecated. Use StitchingOptions instead.",
-        DeprecationWarning,
-        stacklevel=2
-    )
+    _deprecated("PromptingOptions is deprecated. Use StitchingOptions instead.")
 
     # Create and return a StitchingOptions instance
     return StitchingOptions(
@@ -529,11 +588,12 @@ def _raw_to_wav(rawData:bytes, samplerate:int, subtype:str) -> bytes:
             if isinstance(item, bytes):
                 rawData = item
 
-    soundFile = sf.SoundFile(io.BytesIO(rawData), format="RAW", subtype=subtype, channels=1, samplerate=samplerate)
-    wavIO = io.BytesIO()
-    sf.write(wavIO, soundFile.read(), soundFile.samplerate, format="wav")
+    if subtype == "ULAW":
+        rawData = _ULAW_TABLE[np.frombuffer(rawData, dtype=np.uint8)].astype("<i2", copy=False).tobytes()   #The WAV header declares little-endian data, whatever the host uses.
 
-    return wavIO.getvalue()
+    # The data is 16-bit mono PCM at this point, so the WAV is just the 44 byte RIFF header in front of it. No need to decode and re-encode it.
+    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(rawData), b"WAVE", b"fmt ", 16, 1, 1, samplerate, samplerate * 2, 2, 16, b"data", len(rawData))
+    return header + rawData
 def _ulaw_to_wav(ulawData:bytes, samplerate:int) -> bytes:
     """
     This function converts ULAW audio to a WAV.
@@ -562,7 +622,7 @@ def _pcm_to_wav(pcmData:bytes, samplerate:int) -> bytes:
 
 def _open_soundfile(audioData:bytes, audioFormat:str) -> soundfile.SoundFile:
     audioFormat = audioFormat.lower()
-    samplerate = int(audioFormat.split("_")[1])
+    samplerate = _sample_rate_from_format(audioFormat)
     if "ulaw" in audioFormat:
         return soundfile.SoundFile(io.BytesIO(audioData), format="RAW", subtype="ULAW", channels=1, samplerate=samplerate)
     if "pcm" in audioFormat:
@@ -591,7 +651,7 @@ def save_audio_v2(audioData:Union[bytes, numpy.ndarray], saveLocation:Union[Bina
         else:
             raise ValueError("Please specify the actual samplerate in the format. Use user.get_real_audio_format if necessary.")
 
-    samplerate = int(inputFormat.split("_")[1])
+    samplerate = _sample_rate_from_format(inputFormat)
     if isinstance(audioData, bytes):
         # Let's make sure the user didn't just forward a tuple from one of the other functions...
         if isinstance(audioData, tuple):
@@ -622,7 +682,7 @@ def _edit_stream_settings(playbackBlockSize=None, downloadChunkSize=None) -> Non
 
     Parameters:
         playbackBlockSize (int): The size (in frames) of the blocks used for playback.
-        downloadChunkSize (int): The size (in bytes) of the chunks to be downloaded.
+        downloadChunkSize (int): The size (in bytes) of the chunks to be downloaded. None (the default) passes along the data exactly as it's received.
     """
     global _playbackBlockSize, _downloadChunkSize
     if playbackBlockSize is not None:
@@ -663,7 +723,7 @@ class SyncIterator:
 class _SDPlaybackWrapper:
     def __init__(self, audioData:Union[bytes, numpy.ndarray], playbackOptions:PlaybackOptions, audioFormat:str):
         channels = 1
-        samplerate = int(audioFormat.split("_")[1])
+        samplerate = _sample_rate_from_format(audioFormat)
         if isinstance(audioData, bytes):
             soundFile = _open_soundfile(audioData, audioFormat)
             soundFile.seek(0)
@@ -808,6 +868,54 @@ def _text_chunker(chunks: Iterator[Union[str, dict]], generation_options:Generat
     if buffer != "":
         yield {"text": buffer + " ", "try_trigger_generation": False, "flush": False} #We're at the end, so it's not like it actually matters.
 
+_sentence_abbreviations = ("mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "jr.", "sr.", "vs.", "etc.", "e.g.", "i.e.", "a.m.", "p.m.", "am.", "pm.")
+def _ends_sentence(text:str, min_chars:int) -> bool:
+    stripped = text.rstrip().rstrip("\"')]")
+    if len(stripped) < min_chars or not stripped.endswith((".", "?", "!")):
+        return False
+    last_word = stripped.rsplit(None, 1)[-1]
+    if last_word.endswith("."):
+        # Abbreviations and initials (J.) don't end a sentence. "I." and "a." are words, not initials.
+        # Numbers do, unless the next chunk turns them into a decimal - _sentence_chunker checks that.
+        if last_word.lower() in _sentence_abbreviations or (len(last_word) == 2 and last_word[0].isupper() and last_word[0] != "I"):
+            return False
+    return True
+
+def _may_continue_number(text:str) -> bool:
+    #Whether the text ends in "<digit>.", which could be the first half of a decimal (3.5) that got split up.
+    stripped = text.rstrip()
+    return stripped.endswith(".") and stripped[-2:-1].isdigit()
+
+def _can_merge_chunks(first:dict, second:dict) -> bool:
+    #Two input streaming messages can only be sent as one if everything but the text matches.
+    return first.keys() == second.keys() and all(first[key] == second[key] for key in first if key != "text")
+
+def _sentence_chunker(chunks: Iterator[dict], min_chars:int=10) -> Iterator[dict]:
+    """Used with auto_mode to merge the word-level messages from _text_chunker into whole sentences"""
+    pending = None
+    held = False    #pending is a finished sentence ending in a number, only kept in case the next chunk continues it as a decimal.
+    for chunk in chunks:
+        if pending is not None and _can_merge_chunks(pending, chunk) and (not held or chunk["text"][:1].isdigit()):
+            pending["text"] += chunk["text"]
+        else:
+            # Different settings, the first message, or the held sentence really ended - can't merge, so send what we have.
+            if pending is not None:
+                yield pending
+            pending = dict(chunk)
+        held = False
+
+        if pending.get("flush", False):
+            yield pending
+            pending = None
+        elif _ends_sentence(pending["text"], min_chars):
+            if _may_continue_number(pending["text"]):
+                held = True
+            else:
+                yield pending
+                pending = None
+    if pending is not None:
+        yield pending
+
 def _reformat_transcript(alignment_data, current_audio_ms=0) -> (list, int):
     # This is the block that handles re-formatting transcripts.
     formatted_list = list()
@@ -869,7 +977,7 @@ class _AudioStreamer:
         self.connection:Optional[Union[requests.Response, websockets.sync.client.ClientConnection]] = None
 
         self._generation_options = generation_options
-        self.sample_rate = int(generation_options.output_format.split("_")[1])
+        self.sample_rate = generation_options.sample_rate
         self.websocket_options = websocket_options
         self.channels = 1
 
@@ -901,6 +1009,7 @@ class _AudioStreamer:
                 totalLength += len(chunk)
 
         logging.debug("Download finished - " + str(totalLength) + ".")
+        self._stream_downloader_end_handler()
         self._events["downloadDoneEvent"].set()
         return
 
@@ -908,15 +1017,56 @@ class _AudioStreamer:
         totalLength = 0
         logging.debug("Starting iter...")
         self.connection:websockets.sync.client.ClientConnection
-        def sender():
-            for data_dict in _text_chunker(self._prompt, self._generation_options, self.websocket_options):
-                try:
-                    self.connection.send(json.dumps(data_dict))
-                except websockets.exceptions.ConnectionClosedError as e:
-                    logging.exception(f"Generation failed, shutting down: {e}")
-                    raise e
+        text_queue = queue.Queue(maxsize=_inputQueueSize)    #Bounded, so a huge prompt iterator isn't read ahead all at once.
+        no_message = object()   #Marks "nothing was taken from text_queue" (None is the end of the prompt)
+        sender_failed = threading.Event()
+        def producer():
+            # Runs the prompt iterator separately, so text that comes in while a send is in progress can be merged into the next one.
+            try:
+                chunker = _text_chunker(self._prompt, self._generation_options, self.websocket_options)
+                if self.websocket_options.auto_mode:
+                    chunker = _sentence_chunker(chunker)    # auto_mode wants whole sentences, so don't send word by word.
+                for data_dict in chunker:
+                    if sender_failed.is_set():
+                        break   #Nobody is going to send it, stop reading the iterator.
+                    text_queue.put(data_dict)
+            finally:
+                text_queue.put(None)
 
-            self.connection.send(json.dumps(dict(text=""))) # Send end of stream
+        def sender():
+            threading.Thread(target=producer).start()
+            try:
+                pending = text_queue.get()
+                while pending is not None:
+                    message = dict(pending)
+                    pending = no_message
+                    # Merge in whatever else is already waiting, as long as it has the same settings.
+                    while not message.get("flush", False):
+                        try:
+                            pending = text_queue.get_nowait()
+                        except queue.Empty:
+                            pending = no_message
+                            break
+                        if pending is None or not _can_merge_chunks(message, pending):
+                            break
+                        message["text"] += pending["text"]
+                        pending = no_message
+
+                    try:
+                        self.connection.send(json.dumps(message))
+                    except websockets.exceptions.ConnectionClosedError as e:
+                        logging.exception(f"Generation failed, shutting down: {e}")
+                        raise e
+                    if pending is no_message:
+                        pending = text_queue.get()
+
+                self.connection.send(_END_OF_STREAM) # Send end of stream
+            except BaseException:
+                # Whatever went wrong, nothing else will be sent. Stop the producer, and unblock it if it's waiting on a full queue.
+                sender_failed.set()
+                while not text_queue.empty():
+                    text_queue.get_nowait()
+                raise
 
         sender_thread = threading.Thread(target=sender)
         sender_thread.start()
@@ -933,7 +1083,7 @@ class _AudioStreamer:
 
                 audio_data = data.get("audio", None)
                 if audio_data:
-                    chunk = base64.b64decode(data["audio"])
+                    chunk = binascii.a2b_base64(audio_data)   #Skips b64decode's argument coercion, it's called for every frame.
                     self._stream_downloader_chunk_handler(chunk)
                     totalLength += len(chunk)
 
@@ -947,12 +1097,17 @@ class _AudioStreamer:
 
         self.transcript_queue.put(None) #We're done with the transcripts
         logging.debug("Download finished - " + str(totalLength) + ".")
+        self._stream_downloader_end_handler()
         self._events["downloadDoneEvent"].set()
         sender_thread.join()    #Just in case something went wrong.
         self.connection.close_socket() #Close it out.
     def _stream_downloader_chunk_handler(self, chunk):
         pass
 
+    def _stream_downloader_end_handler(self):
+        #Called once the download is over, right before downloadDoneEvent is set.
+        pass
+
 class _NumpyMp3Streamer(_AudioStreamer):
     def __init__(self, streamConnection: Future[Union[requests.Response, websockets.sync.client.ClientConnection]],
                  generation_options:GenerationOptions, websocket_options:WebsocketOptions, prompt: Union[str, Iterator[str], Iterator[dict], bytes, io.IOBase]):
@@ -964,20 +1119,32 @@ class _NumpyMp3Streamer(_AudioStreamer):
             "blockDataAvailable": threading.Event()
         })
 
-        self.playback_queue = queue.Queue()
+        self.playback_queue = queue.SimpleQueue()   #Only ever read by the playback callback, so the lighter queue is enough.
         self.userfacing_queue = queue.Queue()
 
         self._audio_type = "mp3"
         self._frameSize = 4
         self._dtype = "float32"
 
-        self.last_recreated_pos = 0  # Handling for a bug.
-        self._buffer = b""
-        self._audio_length = 0
-
         self._bytesFile = io.BytesIO()
         self._bytesSoundFile: Optional[sf.SoundFile] = None  # Needs to be created later.
         self._bytesLock = threading.Lock()
+        self._end_pos = 0   #How many bytes have been written to _bytesFile. Only touched while holding _bytesLock.
+        self._staging = bytearray()     #Small chunks are collected here (download thread only) so the shared buffer is updated once per block.
+
+    def _stream_downloader_end_handler(self):
+        if len(self._staging) > 0:
+            self._write_to_buffer(self._staging)   #Whatever was still being collected, no more chunks will fill it up.
+            self._staging.clear()
+
+        #Very short files may never reach _mp3HeaderMinBytes, so try to open whatever we got.
+        if not self._events["headerReadyEvent"].is_set():
+            with self._bytesLock:
+                headerReady = self._end_pos > 0
+                if headerReady:
+                    self._events["headerReadyEvent"].set()
+            if headerReady:
+                logging.debug("Download finished before the header threshold, setting headerReady anyway.")
 
     def _stream_downloader_function(self):
         super()._stream_downloader_function()
@@ -991,15 +1158,13 @@ class _NumpyMp3Streamer(_AudioStreamer):
     #Func assumes it has lock
     def _sf_read_and_wait(self, dataToRead:int=-1) -> np.ndarray:
         preReadFramePos = self._bytesSoundFile.tell()
-        readData = self._bytesSoundFile.read(dataToRead, dtype=self._dtype)
+        readData = self._bytesSoundFile.read(dataToRead, dtype=self._dtype, always_2d=True)
 
         # This is the handling for the bug.
         if len(readData) < dataToRead:
             logging.debug(f"Expected {dataToRead} bytes, but got back {len(readData)}")
             logging.debug("Insufficient data read. Check if we're at the end of the file.")
-            curPos = self._bytesFile.tell()
-            endPos = self._bytesFile.seek(0, os.SEEK_END)
-            if curPos != endPos:
+            if self._bytesFile.tell() != self._end_pos:    #_end_pos is kept up to date by the writer, no need to seek to the end to find it.
                 logging.debug("We're not at the end of the file. Check if we're out of frames.")
                 logging.debug("Recreating soundfile...")
                 logging.debug(f"preReadFramePos: {preReadFramePos}")
@@ -1028,7 +1193,7 @@ class _NumpyMp3Streamer(_AudioStreamer):
                     self._bytesSoundFile = newSF
                     del old_soundfile
 
-                    readData = self._bytesSoundFile.read(dataToRead, dtype=self._dtype)
+                    readData = self._bytesSoundFile.read(dataToRead, dtype=self._dtype, always_2d=True)
                     logging.debug("Now read " + str(len(readData)) +
                           " bytes. I sure hope that number isn't zero.")
                 else:
@@ -1036,33 +1201,32 @@ class _NumpyMp3Streamer(_AudioStreamer):
                     del newSF
             else:
                 logging.debug("We are at the end. Nothing to do.")
-        return readData.reshape(-1, self.channels)
+        return readData
 
     def _get_data_from_download_thread(self) -> np.ndarray:
-        self._events["blockDataAvailable"].wait()  # Wait until a block of data is available.
-        self._bytesLock.acquire()
-
-        readData = self._sf_read_and_wait(_playbackBlockSize)
-
-        #Now we seek back and forth to figure out how much "unread" data we have available.
-        currentPos = self._bytesFile.tell()
-        self._bytesFile.seek(0, os.SEEK_END)
-        endPos = self._bytesFile.tell()
-        self._bytesFile.seek(currentPos)
-        remainingBytes = endPos - currentPos
-
-        if remainingBytes < _playbackBlockSize and not self._events["downloadDoneEvent"].is_set():
-            logging.debug("Marking no available blocks...")
-            self._events["blockDataAvailable"].clear()  # Download isn't over and we've consumed enough data to where there isn't another block available.
-
-        logging.debug("Read bytes: " + str(len(readData)) + "\n")
-
-        self._bytesLock.release()
+        blockDataAvailable = self._events["blockDataAvailable"]  #Called once per block, so only look the event up once.
+        blockDataAvailable.wait()  # Wait until a block of data is available.
+        noBlocksLeft = False
+        with self._bytesLock:   #Also releases it if the read raises, so the download thread can't get stuck on it.
+            readData = self._sf_read_and_wait(_playbackBlockSize)
+
+            #Figure out how much "unread" data we have available.
+            remainingBytes = self._end_pos - self._bytesFile.tell()
+
+            if remainingBytes < _playbackBlockSize and not self._events["downloadDoneEvent"].is_set():
+                noBlocksLeft = True
+                blockDataAvailable.clear()  # Download isn't over and we've consumed enough data to where there isn't another block available.
+
+        if noBlocksLeft:
+            logging.debug("Marked no available blocks.")
+        logging.debug("Read bytes: %d", len(readData))
         return readData
 
     def begin_streaming(self):
         self._bytesFile = io.BytesIO()
         self._bytesSoundFile: Optional[sf.SoundFile] = None  # Needs to be created later.
+        self._end_pos = 0
+        self._staging = bytearray()
         self.connection = self.connection_future.result()
 
         if isinstance(self.connection, requests.Response):
@@ -1082,10 +1246,10 @@ class _NumpyMp3Streamer(_AudioStreamer):
                     self._events["soundFileReadyEvent"].set()
                     break
             except sf.LibsndfileError:
-                self._bytesFile.seek(0)
-                dataBytes = self._bytesFile.read()
-                self._bytesFile.seek(0)
-                logging.debug("Error creating the soundfile with " + str(len(dataBytes)) + " bytes of data. Let's clear the headerReady event.")
+                with self._bytesLock:
+                    dataLength = self._end_pos
+                    self._bytesFile.seek(0)
+                logging.debug("Error creating the soundfile with " + str(dataLength) + " bytes of data. Let's clear the headerReady event.")
                 self._events["headerReadyEvent"].clear()
                 self._events["soundFileReadyEvent"].set()
 
@@ -1097,17 +1261,14 @@ class _NumpyMp3Streamer(_AudioStreamer):
                 break
 
             if len(data) == _playbackBlockSize:
-                logging.debug("Putting " + str(len(data)) + " bytes in queue.")
+                logging.debug("Putting %d bytes in queue.", len(data))
                 self.playback_queue.put(data)
                 self.userfacing_queue.put(data)
             else:
                 logging.debug("Got back less data than expected, check if we're at the end...")
                 with self._bytesLock:
                     # This needs to use bytes rather than frames left, as sometimes the number of frames left is wrong.
-                    curPos = self._bytesFile.tell()
-                    endPos = self._bytesFile.seek(0, os.SEEK_END)
-                    self._bytesFile.seek(curPos)
-                    if endPos == curPos and self._events["downloadDoneEvent"].is_set():
+                    if self._bytesFile.tell() == self._end_pos and self._events["downloadDoneEvent"].is_set():
                         logging.debug("We're at the end.")
                         if len(data) > 0:
                             logging.debug("Still some data left, writing it...")
@@ -1125,35 +1286,62 @@ class _NumpyMp3Streamer(_AudioStreamer):
         return
 
     def _stream_downloader_chunk_handler(self, chunk):
-        if self._events["headerReadyEvent"].is_set() and not self._events["soundFileReadyEvent"].is_set():
+        #Called for every downloaded chunk, so look the events up once.
+        headerReadyEvent = self._events["headerReadyEvent"]
+        soundFileReadyEvent = self._events["soundFileReadyEvent"]
+        if headerReadyEvent.is_set() and not soundFileReadyEvent.is_set():
             logging.debug("HeaderReady is set, but waiting for the soundfile...")
-            self._events["soundFileReadyEvent"].wait()  # Wait for the soundfile to be created.
-            if not self._events["headerReadyEvent"].is_set():
+            soundFileReadyEvent.wait()  # Wait for the soundfile to be created.
+            if not headerReadyEvent.is_set():
                 logging.debug("headerReady was cleared by the playback thread. Header data still missing, download more.")
-                self._events["soundFileReadyEvent"].clear()
-
-        if len(chunk) != _downloadChunkSize:
-            logging.debug("Writing weirdly sized chunk (" + str(len(chunk)) + ")...")
-
+                soundFileReadyEvent.clear()
+
+        # Once the header is there, collect small chunks into whole blocks rather than taking the lock and waking the reader for each one.
+        # The reader isn't woken up for less than a block anyway. Header data is never held back, so playback can start as soon as possible.
+        staging = self._staging
+        staging.extend(chunk)
+        if headerReadyEvent.is_set() and len(staging) < _playbackBlockSize:
+            return
+        self._write_to_buffer(staging)
+        staging.clear()
+
+    def _write_to_buffer(self, chunk):
+        headerReadyEvent = self._events["headerReadyEvent"]
         # Write the new data then seek back to the initial position.
+        # Only the BytesIO juggling and the event updates happen under the lock (the playback thread could clear blockDataAvailable in between otherwise), logging happens after.
+        headerWrite = False
+        collectingHeader = False
+        availableBytes = 0
         with self._bytesLock:
-            if not self._events["headerReadyEvent"].is_set():
-                logging.debug("headerReady not set, setting it...")
-                self._bytesFile.seek(0, os.SEEK_END)  # MAKE SURE the head is at the end.
+            if not headerReadyEvent.is_set():
+                collectingHeader = True
+                self._bytesFile.seek(self._end_pos)  # MAKE SURE the head is at the end.
                 self._bytesFile.write(chunk)
+                self._end_pos += len(chunk)
                 self._bytesFile.seek(0)  # Move the head back.
-                self._events["headerReadyEvent"].set()  # We've never downloaded a single chunk before. Do that and move the head back, then fire the event.
+                # Only fire the event once there's enough data for the header to parse, otherwise the playback thread just fails to open it and waits again.
+                if self._end_pos >= _mp3HeaderMinBytes:
+                    headerWrite = True
+                    headerReadyEvent.set()
             else:
                 lastReadPos = self._bytesFile.tell()
-                lastWritePos = self._bytesFile.seek(0, os.SEEK_END)
+                self._bytesFile.seek(self._end_pos)
                 self._bytesFile.write(chunk)
-                endPos = self._bytesFile.tell()
+                self._end_pos += len(chunk)
                 self._bytesFile.seek(lastReadPos)
-                logging.debug("Write head move: " + str(endPos - lastWritePos))
-                if endPos - lastReadPos > _playbackBlockSize:  # We've read enough data to fill up a block, alert the other thread.
-                    logging.debug("Raise available data event - " + str(endPos - lastReadPos) + " bytes available")
+                availableBytes = self._end_pos - lastReadPos
+                if availableBytes > _playbackBlockSize:  # We've read enough data to fill up a block, alert the other thread.
                     self._events["blockDataAvailable"].set()
 
+        if headerWrite:
+            logging.debug("headerReady was not set, wrote the chunk and set it.")
+        elif collectingHeader:
+            logging.debug("Still collecting header data - %d bytes so far", self._end_pos)
+        else:
+            logging.debug("Write head move: %d", len(chunk))
+            if availableBytes > _playbackBlockSize:
+                logging.debug("Raised available data event - %d bytes available", availableBytes)
+
 
 class _NumpyRAWStreamer(_AudioStreamer):
     def __init__(self, streamConnection: Future[Union[requests.Response, websockets.sync.client.ClientConnection]],
@@ -1162,16 +1350,23 @@ class _NumpyRAWStreamer(_AudioStreamer):
         parts = generation_options.output_format.lower().split("_")
         self._subtype = parts[0]
 
-        self.playback_queue = queue.Queue()
+        self.playback_queue = queue.SimpleQueue()
         self.userfacing_queue = queue.Queue()
 
         self._audio_type = "raw"
-        self._frameSize = 2
-        self._dtype = "int16"
+        # The subtype can't change mid-stream, so pick the block converter once here rather than branching on every block.
+        if self._subtype == "ulaw":
+            #u-law stays encoded in the buffer (one byte per sample) and is only expanded when a block is converted.
+            self._frameSize = 1
+            self._dtype = "uint8"
+            self._raw_to_float32 = self._ulaw_to_float32
+        else:
+            self._frameSize = 2
+            self._dtype = "int16"
+            self._raw_to_float32 = self._pcm_to_float32
+        self._block_bytes = _playbackBlockSize * self._frameSize
 
-        self.last_recreated_pos = 0  # Handling for a bug.
-        self._buffer = b""
-        self._audio_length = 0
+        self._buffer = bytearray()
 
     def begin_streaming(self):
         logging.debug("Beginning stream...")
@@ -1187,57 +1382,95 @@ class _NumpyRAWStreamer(_AudioStreamer):
 
         return
 
-    def _stream_downloader_chunk_handler(self, chunk):
-        if self._subtype.lower() == "ulaw":
-            chunk = audioop.ulaw2lin(chunk, 2)
-        self._buffer += chunk
-        self._audio_length += len(chunk)
-
-        while len(self._buffer) >= _playbackBlockSize*self._frameSize:
-            curr_pos = (self._audio_length-len(self._buffer)) // self._frameSize
-            frame_data, self._buffer = self._buffer[:_playbackBlockSize*self._frameSize], self._buffer[_playbackBlockSize*self._frameSize:]
-            audioData = numpy.frombuffer(frame_data, dtype=self._dtype)
-            audioData = audioData.reshape(-1, self.channels)
-            audioData = audioData.astype(np.float32)
-            audioData /= np.iinfo(np.int16).max
-
-            self.playback_queue.put(audioData)
-            self.userfacing_queue.put(audioData)
+    def _ulaw_to_float32(self, data) -> np.ndarray:
+        audioData = _ULAW_FLOAT_TABLE[np.frombuffer(data, dtype=np.uint8)]
+        audioData.shape = (-1, self.channels)  #Freshly allocated and contiguous, so this never copies.
+        return audioData
+
+    def _pcm_to_float32(self, data) -> np.ndarray:
+        audioData = np.multiply(np.frombuffer(data, dtype=np.int16), _INT16_INV, dtype=np.float32)
+        audioData.shape = (-1, self.channels)
+        return audioData
 
-        if self._events["downloadDoneEvent"].is_set() and len(self._buffer) > 0:
-            audioData = numpy.frombuffer(self._buffer, dtype=self._dtype)
-            curr_pos = (self._audio_length - len(self._buffer)) // self._frameSize
-            audioData = audioData.reshape(-1, self.channels)
+    def _stream_downloader_chunk_handler(self, chunk):
+        # Bind everything the loop touches once, this runs for every block of the stream.
+        buffer = self._buffer
+        blockBytes = self._block_bytes
+        toFloat32 = self._raw_to_float32
+        userfacingPut = self.userfacing_queue.put
+        buffer.extend(chunk)
+
+        consumedBytes = len(buffer) - len(buffer) % blockBytes
+        if consumedBytes == 0:
+            return
+
+        batch = []  #Every block this chunk completes goes to the playback thread in a single put.
+        # Convert straight out of the bytearray. The view has to be released before the buffer can be resized.
+        with memoryview(buffer) as view:
+            for offset in range(0, consumedBytes, blockBytes):
+                audioData = toFloat32(view[offset:offset + blockBytes])
+                batch.append(audioData)
+                userfacingPut(audioData)
+        del buffer[:consumedBytes]  # Drop all the converted blocks at once, rather than shifting the remainder down after each one.
+        self.playback_queue.put(batch)
+
+    def _stream_downloader_end_handler(self):
+        #Flush whatever is left over (less than a full block), since no further chunk will complete it.
+        if len(self._buffer) > 0:
             # Normalize to float32
-            audioData = audioData.astype(np.float32)
-            audioData /= np.iinfo(np.int16).max
+            audioData = self._raw_to_float32(self._buffer)
+            self._buffer.clear()
 
-            self.playback_queue.put(audioData)
+            self.playback_queue.put(audioData)  # The callback zero-pads this short block, no need to add silence here.
             self.userfacing_queue.put(audioData)
 
-            # Pad the end of the audio with silence to avoid the looping final chunk.s
-            silence_chunk = np.zeros(_playbackBlockSize * self.channels, dtype=self._dtype).reshape(-1, self.channels)
-            silence_chunk = silence_chunk.astype(np.float32)
-            silence_chunk /= np.iinfo(np.int16).max
-            for _ in range(2):
-                self.playback_queue.put(silence_chunk)   #We don't add it to the duplicate queue, as this is just a fix for the playback.
-            self.playback_queue.put(None)
-            self.userfacing_queue.put(None)
-
 
 class _NumpyPlaybacker:
-    def __init__(self, audio_queue:queue.Queue, playbackOptions:PlaybackOptions, generationOptions:GenerationOptions):
+    PREBUFFER_SECONDS = 0.5 #How much audio to queue up before starting the output stream, so network jitter doesn't immediately cause underruns.
+
+    def __init__(self, audio_queue:queue.SimpleQueue, playbackOptions:PlaybackOptions, generationOptions:GenerationOptions):
         self._playback_start_fired = threading.Event()
         self._playback_finished = threading.Event()
 
         self._queue = audio_queue
+        self._pending = collections.deque()   #Blocks that arrived as part of a batch and haven't been played yet.
+        self._prebuffering = True   #The callback leaves the queue alone (and plays silence) while this is set.
 
         self._onPlaybackStart = playbackOptions.onPlaybackStart
         self._onPlaybackEnd = playbackOptions.onPlaybackEnd
         self._audioPostProcessor = playbackOptions.audioPostProcessor
         self._deviceID = playbackOptions.portaudioDeviceID or sd.default.device
         self._channels = 1
-        self._sample_rate = int(generationOptions.output_format.split("_")[1])
+        self._sample_rate = generationOptions.sample_rate
+
+    def _prebuffer(self):
+        targetBlocks = int(self.PREBUFFER_SECONDS * self._sample_rate) // _playbackBlockSize + 1
+        while True:  # Wait for the first audio to show up at all, unless the stream gets stopped in the meantime.
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._playback_finished.is_set():
+                    logging.debug("Stream was stopped before any audio arrived.")
+                    return
+        # From then on, wait at most PREBUFFER_SECONDS for the rest, so slow input streaming doesn't hold up playback.
+        deadline = time.perf_counter() + self.PREBUFFER_SECONDS
+        while True:
+            if isinstance(item, list):
+                self._pending.extend(item)
+            else:
+                self._pending.append(item)
+
+            if item is None or len(self._pending) >= targetBlocks:
+                break
+            remainingTime = deadline - time.perf_counter()
+            if remainingTime <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remainingTime)
+            except queue.Empty:
+                break
+        logging.debug("Prebuffered %d blocks.", len(self._pending))
 
     def begin_playback(self, future:concurrent.futures.Future):
         stream = sd.OutputStream(samplerate=self._sample_rate, blocksize=_playbackBlockSize,
@@ -1245,10 +1478,21 @@ class _NumpyPlaybacker:
                                  dtype="float32", callback=self._callback, finished_callback=self._playback_finished.set)
         #dtype is guaranteed by the _NumpyStreamers to always be float32
 
-        future.set_result(stream)
+        future.set_result(stream)   #Publish the stream right away, so callers can stop it (or wait on it) while we're still prebuffering.
         logging.debug("Starting playback...")
 
         with stream:
+            # The callback outputs silence until the prebuffering is done. Stopping the stream in the meantime ends playback as usual.
+            self._prebuffer()
+            hasAudio = len(self._pending) > 0 and self._pending[0] is not None    #Checked before the callback starts popping from _pending.
+            self._prebuffering = False
+
+            # Fire onPlaybackStart from here rather than from the callback, so user code never runs on the audio thread.
+            # The prebuffered audio is handed to the callback from this point on, so this is when it becomes audible.
+            if hasAudio and stream.active:
+                self._playback_start_fired.set()
+                logging.debug("Firing onPlaybackStart...")
+                self._onPlaybackStart()
             self._playback_finished.wait()  # Wait until playback is finished
             self._onPlaybackEnd()
             logging.debug(stream.active)
@@ -1257,13 +1501,23 @@ class _NumpyPlaybacker:
 
     def _callback(self, outdata, frames, timeData, status):
         assert frames == _playbackBlockSize
+        if self._prebuffering:  #begin_playback is still filling _pending, don't touch it yet.
+            outdata.fill(0)
+            return
         readData:np.ndarray = None
         while True:
             try:
-                readData = self._queue.get(timeout=5)  # Download isn't over so we may have to wait.
+                if len(self._pending) > 0:
+                    readData = self._pending.popleft()
+                else:
+                    readData = self._queue.get_nowait()  # Never block the audio thread, if nothing's ready we play silence instead.
+                    if isinstance(readData, list):  # Streamers can put several blocks at once.
+                        self._pending.extend(readData)
+                        readData = self._pending.popleft()
 
                 if readData is None:
                     logging.debug("Download (and playback) finished.")  # We're done.
+                    outdata.fill(0)  # Whatever is in outdata still gets played after CallbackStop, so make sure it's silence and not the last block again.
                     raise sd.CallbackStop
 
                 if len(readData) == 0:
@@ -1272,16 +1526,12 @@ class _NumpyPlaybacker:
                 break
             except queue.Empty as e:
                 if self._playback_start_fired.is_set():
-                    logging.error("Could not get an item within the timeout (after the playback began). This could lead to audio issues.")
-                continue
-                    # raise sd.CallbackAbort
+                    logging.debug("Playback queue ran dry (after the playback began), outputting silence.")
+                outdata.fill(0)
+                return
         # We've read an item from the queue - process it.
         logging.debug("Applying postprocessing to audio...")
         readData = self._audioPostProcessor(readData, self._sample_rate)
-        if not self._playback_start_fired.is_set():  # Ensure the callback only fires once.
-            self._playback_start_fired.set()
-            logging.debug("Firing onPlaybackStart...")
-            self._onPlaybackStart()
 
         # Last read chunk was smaller than it should've been. It's either EOF or that stupid soundFile bug.
         if 0 < len(readData) < len(outdata):
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import asyncio
-import audioop
 import base64
 import concurrent.futures
 import warnings
@@ -16,7 +15,6 @@ import threading
 import time
 import zlib
 from typing import Optional, BinaryIO, Callable, Union, Any, Iterator, List, AsyncIterator, Tuple, TYPE_CHECKING, TextIO, Dict
-from warnings import warn
 import json
 import numpy
 import numpy as np
@@ -32,11 +30,11 @@ from typing import TYPE_CHECKING
 import websockets
 import websockets.sync.client
 
-from elevenlabslib.helpers import SyncIterator, _NumpyRAWStreamer, _NumpyMp3Streamer, _NumpyPlaybacker
+from elevenlabslib.helpers import SyncIterator, _deprecated, _NumpyRAWStreamer, _NumpyMp3Streamer, _NumpyPlaybacker
 
 # These are hardcoded because they just plain work. If you really want to change them, please be careful.
 _playbackBlockSize = 2048
-_downloadChunkSize = 4096
+_downloadChunkSize = None
 
 
 from elevenlabslib.Voice import Voice
@@ -210,7 +208,7 @@ class Synthesizer:
         """
         Allows you to change the current output device.
         """
-        warn("This is deprecated, use change_default_settings to change it through the defaultPlaybackOptions instead.", DeprecationWarning)
+        _deprecated("This is deprecated, use change_default_settings to change it through the defaultPlaybackOptions instead.")
         self._defaultPlayOptions.portaudioDeviceID = portAudioDeviceID
 
     def change_default_settings(self, defaultGenerationOptions:GenerationOptions=None, defaultPlaybackOptions:PlaybackOptions=None):
@@ -355,7 +353,7 @@ class ReusableInputStreamer:
     def _renew_socket(self):
         self._websocket_ready_event.clear()
         self._websocket = None
-        self._currentGenOptions = self._voice._complete_generation_options(self._generationOptions) # noqa - Yes, it's internal.
+        self._currentGenOptions = self._voice.linkedUser.get_real_audio_format(self._generationOptions)
         self._websocket = self._voice._generate_websocket(self._websocketOptions, self._generationOptions) # noqa - Yes, it's internal.
         self._websocket_ready_event.set()
         self._last_renewal_time = time.perf_counter()
@@ -507,7 +505,7 @@ class ReusableInputStreamerNoPlayback:
     def _renew_socket(self):
         self._websocket_ready_event.clear()
         self._websocket = None
-        self._currentGenOptions = self._voice._complete_generation_options(self._generationOptions) # noqa - Yes, it's internal.
+        self._currentGenOptions = self._voice.linkedUser.get_real_audio_format(self._generationOptions)
         self._websocket = self._voice._generate_websocket(self._websocketOptions, self._generationOptions) # noqa - Yes, it's internal.
         self._websocket_ready_event.set()
         self._last_renewal_time = time.perf_counter()
@@ -574,7 +572,7 @@ class ReusableInputStreamerNoPlayback:
             else:
                 streamer = _NumpyRAWStreamer(temp_future, self._currentGenOptions, self._websocketOptions, prompt)
 
-            audio_queue_future.set_result(streamer.playback_queue)
+            audio_queue_future.set_result(streamer.userfacing_queue)
             transcript_queue_future.set_result(streamer.transcript_queue)
             streamer.begin_streaming()
             current_socket.close_socket()